@@ -54,6 +54,20 @@ class OfCtl(object):
         # data_str = str(packet.Packet(data))
         # self.logger.debug('Packet out = %s', data_str, extra=self.sw_id)
 
+    def get_packet_out(self, in_port, output, data=None):
+        actions = [self.ofp_parser.OFPActionOutput(output)]
+        return self.ofp_parser.OFPPacketOut(datapath=self.dp,
+                                            buffer_id=self.ofp.OFP_NO_BUFFER,
+                                            in_port=in_port,
+                                            actions=actions,
+                                            data=data)
+
+    def send_msg(self, msg):
+        # Messages can be sent more than once, let the datapath assign a
+        # new xid every time.
+        msg.xid = None
+        self.dp.send_msg(msg)
+
     def set_normal_flow(self, cookie, priority):
         # out_port = self.dp.ofproto.OFPP_NORMAL
         # actions = [self.dp.ofproto_parser.OFPActionOutput(out_port, 0)]
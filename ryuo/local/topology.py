@@ -1,20 +1,25 @@
+import heapq
+import struct
 import time
 import logging
 
 from ryu.controller import ofp_event, event
 from ryu.controller.handler import set_ev_cls, MAIN_DISPATCHER
-from ryu.lib import hub
+from ryu.lib import addrconv, hub
 from ryu.lib.mac import DONTCARE_STR
-from ryu.lib.packet import lldp, packet
+from ryu.lib.packet import lldp
 from ryu.ofproto.ether import ETH_TYPE_LLDP
 from ryu.topology.switches import LLDPPacket, PortDataState, Link, LinkState
 
-from ryuo.constants import ETHERNET
 from ryuo.local.local_service import LocalService
 from ryuo.topology.common import PortData, Port
 
 LOG = logging.getLogger(__name__)
 
+# Link timestamps should not jump with the wall clock (e.g. an NTP step),
+# use the monotonic clock when the Python version has one.
+_link_clock = getattr(time, 'monotonic', time.time)
+
 
 class EventLinkBase(event.EventBase):
     def __init__(self, link):
@@ -136,40 +141,90 @@ class Topology(LocalService):
     """
     DEFAULT_TTL = 64
     LLDP_PACKET_LEN = len(LLDPPacket.lldp_packet(0, 0, DONTCARE_STR, 0))
+    LLDP_ETH_TYPE = struct.pack('!H', ETH_TYPE_LLDP)
     LLDP_SEND_GUARD = .05
+    LLDP_SEND_BATCH = 8  # LLDP packets sent between two guards
     LLDP_SEND_PERIOD_PER_PORT = .9
     TIMEOUT_CHECK_PERIOD = 5.
     LINK_TIMEOUT = TIMEOUT_CHECK_PERIOD * 2
     LINK_LLDP_DROP = 5
     LLDP_PRIORITY = 0xFFFF
+    _LLDP_CACHE = {}  # (dpid, port_no, hw_addr) -> LLDP packet
 
     def __init__(self, *args, **kwargs):
         super(Topology, self).__init__(*args, **kwargs)
         self.is_active = True
         self.explicit_drop = True
         self.ports = PortDataState()
+        self._port_by_no = {}  # port_no -> Port
+        self._port_data_list = []  # PortData of self.ports, for switch_enter
+        self._lldp_heap = []  # (expire, port_no), 0 to send immediately
+        self._lldp_packet_outs = {}  # port_no -> OFPPacketOut
         self.links = _LinkState()
         self.lldp_event = hub.Event()
         self.link_event = hub.Event()
         self.threads.append(hub.spawn(self.lldp_loop))
         self.threads.append(hub.spawn(self.link_loop))
 
+    def _lldp_packet(self, port):
+        key = (port.dpid, port.port_no, port.hw_addr)
+        lldp_data = self._LLDP_CACHE.get(key)
+        if lldp_data is None:
+            lldp_data = LLDPPacket.lldp_packet(
+                port.dpid, port.port_no, port.hw_addr, self.DEFAULT_TTL)
+            self._LLDP_CACHE[key] = lldp_data
+        return lldp_data
+
     def _port_added(self, port):
-        lldp_data = LLDPPacket.lldp_packet(
-            port.dpid, port.port_no, port.hw_addr, self.DEFAULT_TTL)
+        lldp_data = self._lldp_packet(port)
+        known = port in self.ports
+        if not known:
+            self._port_by_no[port.port_no] = port
+            self._port_data_list.append(port.port_data)
         self.ports.add_port(port, lldp_data)
+        if known:
+            # A known port may have left the LLDP schedule while it was
+            # down, clear its timestamp so it is sent right away again.
+            self.ports.move_front(port)
+        # Only the LLDP data may change, reuse the message for every send.
+        self._lldp_packet_outs[port.port_no] = self.ofctl.get_packet_out(
+            in_port=self.dp.ofproto.OFPP_CONTROLLER,
+            output=port.port_no,
+            data=lldp_data)
+        self._schedule_lldp(port.port_no)
+
+    def _schedule_lldp(self, port_no, expire=0):
+        heap = self._lldp_heap
+        # lldp_loop() already wakes up for the earliest entry, so only
+        # wake it up if this one is due before that.
+        wake = not heap or expire < heap[0][0]
+        heapq.heappush(heap, (expire, port_no))
+        if wake:
+            self.lldp_event.set()
+
+    def _lldp_due_port(self, expire, port_no):
+        # Entries are invalidated lazily: an entry is only valid if it
+        # matches the current timestamp of a port we still have.
+        port = self._port_by_no.get(port_no)
+        if port is None:
+            return None
+        port_data = self.ports.get(port)
+        if port_data is None:
+            return None
+        if port_data.timestamp is None:
+            return port if expire == 0 else None
+        if port_data.timestamp + self.LLDP_SEND_PERIOD_PER_PORT != expire:
+            return None
+        return port
 
     def _switch_enter(self, dp):
         super(Topology, self)._switch_enter(dp)
         self._init_flows()
-        ports = [Port(PortData(dp.id, port, dp.ofproto)) for port in
-                 dp.ports.values()]
-        for port in ports:
-            if not port.is_reserved():
-                self._port_added(port)
-        self.ryuo.switch_enter(dp.id,
-                               [port.port_data for port in self.ports.keys()])
-        self.lldp_event.set()
+        ofpp_max = dp.ofproto.OFPP_MAX
+        for ofpport in dp.ports.values():
+            if ofpport.port_no <= ofpp_max:
+                self._port_added(Port(PortData(dp.id, ofpport, dp.ofproto)))
+        self.ryuo.switch_enter(dp.id, self._port_data_list)
 
     def _init_flows(self):
         self._logger.info('Init flow table.')
@@ -181,11 +236,13 @@ class Topology(LocalService):
         super(Topology, self)._switch_leave()
         self.links.clear()
         self.ports.clear()
+        self._port_by_no.clear()
+        del self._port_data_list[:]
+        self._lldp_packet_outs.clear()
+        del self._lldp_heap[:]
 
     def _get_port(self, port_no):
-        for port in self.ports.keys():
-            if port.port_no == port_no:
-                return port
+        return self._port_by_no.get(port_no)
 
     def _report_port_added(self, port):
         self.send_event_to_observers(EventPortAdd(port))
@@ -215,25 +272,31 @@ class Topology(LocalService):
             if not port.is_reserved():
                 self._port_added(port)
                 self._report_port_added(port)
-                self.lldp_event.set()
         elif reason == ofp.OFPPR_DELETE:
             self._logger.info('Port %d deleted.', ofpport.port_no)
             port = self._get_port(ofpport.port_no)
             if port and not port.is_reserved():
-                del self.ports[Port(PortData(self.dp.id, ofpport))]
+                self.ports.del_port(port)
+                self._port_by_no.pop(ofpport.port_no, None)
+                self._port_data_list.remove(port.port_data)
+                self._lldp_packet_outs.pop(ofpport.port_no, None)
                 self._report_port_deleted(port)
                 self._link_down(port)
-                self.lldp_event.set()
         else:
             self._logger.info('Port %d modified.', ofpport.port_no)
             port = self._get_port(ofpport.port_no)
-            port.lldp_reply = False
             if port and not port.is_reserved():
+                old_hw_addr = port.hw_addr
                 port.modify(ofpport)
+                if port.hw_addr != old_hw_addr:
+                    self._LLDP_CACHE.pop(
+                        (port.dpid, port.port_no, old_hw_addr), None)
+                    self.ports.get_port(port).lldp_data = \
+                        self._lldp_packet(port)
                 self._report_port_modified(port)
                 if self.ports.set_down(port):
                     self._link_down(port)
-                self.lldp_event.set()
+                self._schedule_lldp(port.port_no)
 
     def send_lldp_packet(self, port):
         try:
@@ -251,47 +314,48 @@ class Topology(LocalService):
             self._logger.warning('Switch left.')
             return
 
-        self.ofctl.send_packet_out(in_port=dp.ofproto.OFPP_CONTROLLER,
-                                   output=port.port_no,
-                                   data=port_data.lldp_data)
+        packet_out = self._lldp_packet_outs[port.port_no]
+        packet_out.data = port_data.lldp_data
+        self.ofctl.send_msg(packet_out)
+        self._schedule_lldp(
+            port.port_no,
+            port_data.timestamp + self.LLDP_SEND_PERIOD_PER_PORT)
 
     def lldp_loop(self):
         while self.is_active:
             self._logger.debug('LLDP loop')
             self.lldp_event.clear()
 
-            now = time.time()
-            timeout = None
-            ports_now = []
-            ports = []
-            for (key, data) in self.ports.items():
-                if data.timestamp is None:
-                    ports_now.append(key)
-                    continue
+            # Bind what the loop below uses on every port to locals.
+            heap = self._lldp_heap
+            heappop = heapq.heappop
+            due_port = self._lldp_due_port
+            send = self.send_lldp_packet
+            debug = self._logger.debug
+            batch = self.LLDP_SEND_BATCH
+            guard = self.LLDP_SEND_GUARD
 
-                expire = data.timestamp + self.LLDP_SEND_PERIOD_PER_PORT
-                if expire <= now:
-                    ports.append(key)
+            timeout = None
+            sent_since_guard = 0
+            now = time.time()
+            while heap:
+                expire, port_no = heap[0]
+                if expire > now:
+                    timeout = expire - now
+                    break
+                heappop(heap)
+                port = due_port(expire, port_no)
+                if port is None:
                     continue
+                send(port)
+                debug('Sending LLDP to %d.%d', port.dpid, port.port_no)
+                if expire:
+                    sent_since_guard += 1
+                    if sent_since_guard >= batch:
+                        hub.sleep(guard)  # don't burst
+                        sent_since_guard = 0
+                        now = time.time()
 
-                if timeout is None or timeout > expire - now:
-                    timeout = expire - now
-                    # break
-
-            for port in ports_now:
-                self.send_lldp_packet(port)
-                self._logger.debug('Sending LLDP to %d.%d',
-                                   port.dpid,
-                                   port.port_no)
-            for port in ports:
-                self.send_lldp_packet(port)
-                self._logger.debug('Sending LLDP to %d.%d',
-                                   port.dpid,
-                                   port.port_no)
-                hub.sleep(self.LLDP_SEND_GUARD)  # don't burst
-
-            if timeout is not None and ports:
-                timeout = 0  # We have already slept
             # LOG.debug('lldp sleep %s', timeout)
             self.lldp_event.wait(timeout=timeout)
 
@@ -307,13 +371,15 @@ class Topology(LocalService):
     def packet_in_handler(self, ev):
         self._logger.debug('Packet in')
         msg = ev.msg
-        ofp = msg.datapath.ofproto
-        pkt = packet.Packet(msg.data)
-        headers = dict((p.protocol_name, p)
-                       for p in pkt.protocols if type(p) != str)
-        src_mac = headers[ETHERNET].src
+        data = msg.data
+        # Reject packets that cannot be our LLDP before parsing them.
+        if len(data) < self.LLDP_PACKET_LEN \
+                or data[12:14] != self.LLDP_ETH_TYPE:
+            self._logger.debug('Not a LLDP packet')
+            return
+        src_mac = addrconv.mac.bin_to_text(data[6:12])
         try:
-            src_dpid, src_port_no = LLDPPacket.lldp_parse(msg.data)
+            src_dpid, src_port_no = LLDPPacket.lldp_parse(data)
         except LLDPPacket.LLDPUnknownFormat as e:
             self._logger.debug('LLDPUnknownFormat %s', e)
             return
@@ -335,10 +401,10 @@ class Topology(LocalService):
             self._report_link_deleted(Link(old_peer, dst))
             need_update = True
         link = Link(src, dst)
+        # self.links is a dict keyed by Link, so this is a hash lookup.
         if link not in self.links:
             need_update = True
-            self._report_link_added(Link(src, dst))
-            self.lldp_event.set()
+            self._report_link_added(link)
 
         # Always return false, since we don't have the reverse link information
         if need_update:
@@ -353,16 +419,20 @@ class Topology(LocalService):
         while self.is_active:
             self.link_event.clear()
 
-            now = time.time()
+            ports = self.ports
+            link_timeout = self.LINK_TIMEOUT
+            lldp_drop = self.LINK_LLDP_DROP
+
+            now = _link_clock()
             deleted = []
             for (link, timestamp) in self.links.items():
                 # LOG.debug('%s timestamp %d (now %d)', link, timestamp, now)
-                if timestamp + self.LINK_TIMEOUT < now:
+                if timestamp + link_timeout < now:
                     src = link.src
-                    if src in self.ports:
-                        port_data = self.ports.get_port(src)
+                    if src in ports:
+                        port_data = ports.get_port(src)
                         # LOG.debug('port_data %s', port_data)
-                        if port_data.lldp_dropped() > self.LINK_LLDP_DROP:
+                        if port_data.lldp_dropped() > lldp_drop:
                             deleted.append(link)
 
             for link in deleted:
@@ -407,7 +477,9 @@ class _LinkState(LinkState):
 
     def update_link(self, src, dst):
         self._rmap[dst] = src
-        return super(_LinkState, self).update_link(src, dst)
+        rev_link_up = super(_LinkState, self).update_link(src, dst)
+        self[Link(src, dst)] = _link_clock()
+        return rev_link_up
 
     def link_down(self, link):
         del self._rmap[link.dst]
@@ -1,29 +1,46 @@
 import logging
 from threading import Lock
 
+try:
+    _intern = intern  # Python 2
+except NameError:
+    from sys import intern as _intern
+
 from ryu.lib.dpid import dpid_to_str
 from ryu.lib.port_no import port_no_to_str
 
 
 LOG = logging.getLogger(__name__)
 
+_LIVE_MSG = ('DOWN', 'LIVE')  # indexed by Port.is_alive()
+
+
+def _intern_hw_addr(hw_addr):
+    # Interned strings are freed once no port refers to them anymore.
+    if isinstance(hw_addr, str):
+        return _intern(hw_addr)
+    return hw_addr
+
 
 class PortData(object):
     """
     Passing port information between ryuo and ryu.
     """
 
+    __slots__ = ('dpid', 'port_no', 'hw_addr', 'ofpport', 'OFPP_MAX',
+                 'OFPPS_LINK_DOWN', 'OFPPC_PORT_DOWN')
+
     def __init__(self, dpid, ofpport=None, ofproto=None, port_no=None,
                  hw_addr=None):
         super(PortData, self).__init__()
         self.dpid = dpid
 
         self.port_no = port_no
-        self.hw_addr = hw_addr
+        self.hw_addr = _intern_hw_addr(hw_addr)
         self.ofpport = None
         if ofpport:
             self.port_no = ofpport.port_no
-            self.hw_addr = ofpport.hw_addr
+            self.hw_addr = _intern_hw_addr(ofpport.hw_addr)
             self.ofpport = ofpport
             self.OFPP_MAX = ofproto.OFPP_MAX
             self.OFPPS_LINK_DOWN = ofproto.OFPPS_LINK_DOWN
@@ -36,7 +53,8 @@ class Port(object):
     an ofproto object
     """
 
-    LIVE_MSG = {False: 'DOWN', True: 'LIVE'}
+    __slots__ = ('dpid', 'port_no', 'hw_addr', 'name', 'port_data', '_hash',
+                 '_is_reserved', '_is_down', '_clean_name')
 
     def __init__(self, port_data):
         super(Port, self).__init__()
@@ -44,36 +62,53 @@ class Port(object):
 
         self.port_no = port_data.port_no
         self.hw_addr = port_data.hw_addr
+        self._hash = hash((self.dpid, self.port_no))
 
         if port_data.ofpport:
-            self.hw_addr = port_data.ofpport.hw_addr
             self.name = port_data.ofpport.name
         else:
             self.name = "N/A"
+        self._clean_name = self.name.rstrip('\0')
 
         self.port_data = port_data
+        # Port state is cached here since it is checked on every LLDP
+        # sent and received. Ports built from LLDP packets carry no
+        # ofpport and are neither reserved nor down.
+        self._is_reserved = False
+        if port_data.ofpport:
+            self._is_reserved = self.port_no > port_data.OFPP_MAX
+        self._update_state()
+
+    def _update_state(self):
+        ofpport = self.port_data.ofpport
+        self._is_down = False
+        if ofpport:
+            self._is_down = \
+                (ofpport.state & self.port_data.OFPPS_LINK_DOWN) > 0 \
+                or (ofpport.config & self.port_data.OFPPC_PORT_DOWN) > 0
 
     def modify(self, ofpport):
         self.port_data.ofpport = ofpport
-        self.hw_addr = ofpport.hw_addr
+        self.port_data.hw_addr = _intern_hw_addr(ofpport.hw_addr)
+        self.hw_addr = self.port_data.hw_addr
         self.name = ofpport.name
+        self._clean_name = self.name.rstrip('\0')
+        self._update_state()
 
     def is_reserved(self):
-        return self.port_no > self.port_data.OFPP_MAX
+        return self._is_reserved
 
     def is_down(self):
-        ofpport = self.port_data.ofpport
-        return (ofpport.state & self.port_data.OFPPS_LINK_DOWN) > 0 \
-               or (ofpport.config & self.port_data.OFPPC_PORT_DOWN) > 0
+        return self._is_down
 
     def is_alive(self):
-        return not self.is_down()
+        return not self._is_down
 
     def to_dict(self):
         return {'dpid': dpid_to_str(self.dpid),
                 'port_no': port_no_to_str(self.port_no),
                 'hw_addr': self.hw_addr,
-                'name': self.name.rstrip('\0')}
+                'name': self._clean_name}
 
     def __eq__(self, other):
         return self.dpid == other.dpid and self.port_no == other.port_no
@@ -82,11 +117,11 @@ class Port(object):
         return not self.__eq__(other)
 
     def __hash__(self):
-        return hash((self.dpid, self.port_no))
+        return self._hash
 
     def __str__(self):
         return 'Port<dpid=%s, port_no=%s, %s>' % \
-               (self.dpid, self.port_no, self.LIVE_MSG[self.is_alive()])
+               (self.dpid, self.port_no, _LIVE_MSG[self.is_alive()])
 
 
 class Switch(object):
@@ -106,10 +141,15 @@ class Switch(object):
 
     def update_port(self, port_data):
         port = self.ports[port_data.port_no]
-        if port_data.ofpport is None:
+        # Port data built from LLDP packets carries no port state,
+        # keep the cached one in that case.
+        has_state = port_data.ofpport is not None
+        if not has_state:
             port_data.ofpport = port.port_data.ofpport
         port.port_data = port_data
         port.hw_addr = port_data.hw_addr
+        if has_state:
+            port._update_state()
         return port
 
     def del_port(self, port_data):
@@ -123,8 +163,5 @@ class Switch(object):
                 'ports': [port.to_dict() for port in self.ports.values()]}
 
     def __str__(self):
-        msg = 'Switch<dpid=%s, ' % self.dpid
-        for port in self.ports.values():
-            msg += str(port) + ' '
-        msg += '>'
-        return msg
+        return 'Switch<dpid=%s, %s>' % \
+               (self.dpid, ' '.join(str(port) for port in self.ports.values()))